@@ -27,44 +27,48 @@ def main():
     args = parser.parse_args()
 
     print("--- Reconstructing Validation SCP ---")
-    
-    # Step 1: Load the master SCP into a dictionary for fast lookups.
-    print(f"Reading master SCP from: {args.master_scp}")
-    master_map = {}
+
+    # Step 1: Load the (small) validation UIDs into a set.
+    print(f"Reading validation list from: {args.validation_list}")
     try:
-        with open(args.master_scp, 'r', encoding='utf-8') as f:
-            for line in f:
-                parts = line.strip().split(maxsplit=1)
-                if len(parts) == 2:
-                    master_map[parts[0]] = parts[1] # {uid: "sr /path/to/file.wav"}
+        with open(args.validation_list, 'r', encoding='utf-8', buffering=1 << 20) as f_list:
+            wanted = {line.split()[0] for line in f_list if line.strip()}
     except FileNotFoundError:
-        print(f"ERROR: Master SCP file not found at {args.master_scp}. Aborting.")
+        print(f"ERROR: Validation list file not found at {args.validation_list}. Aborting.")
         return
-    print(f"  -> Loaded {len(master_map)} entries.")
+    print(f"  -> Loaded {len(wanted)} validation UIDs.")
 
-    # Step 2: Read the validation list and reconstruct the output SCP.
-    print(f"Reading validation list from: {args.validation_list}")
+    # Step 2: Stream the master SCP once, writing matching lines through.
+    # This keeps peak memory at O(validation list) instead of O(master SCP).
+    print(f"Streaming master SCP from: {args.master_scp}")
     lines_reconstructed = 0
-    lines_missing = 0
     try:
-        with open(args.validation_list, 'r', encoding='utf-8') as f_list, \
-             open(args.output_scp, 'w', encoding='utf-8') as f_out:
-            
-            for line in f_list:
-                uid = line.strip().split()[0]
-                
-                # Look up the UID in our master map.
-                if uid in master_map:
-                    # Reconstruct the full line.
-                    f_out.write(f"{uid} {master_map[uid]}\n")
+        with open(args.master_scp, 'r', encoding='utf-8', buffering=1 << 20) as f_in, \
+             open(args.output_scp, 'w', encoding='utf-8', buffering=1 << 20) as f_out:
+
+            # Collect matches and flush them in batches so the write side is
+            # one writelines call per ~10k lines instead of one write per line.
+            batch = []
+            for line in f_in:
+                uid = line.split(maxsplit=1)[0] if line.strip() else None
+                if uid in wanted:
+                    batch.append(line)
                     lines_reconstructed += 1
-                else:
-                    print(f"Warning: UID '{uid}' from validation list was not found in the master SCP. Skipping.")
-                    lines_missing += 1
+                    wanted.discard(uid)
+                    if len(batch) >= 10000:
+                        f_out.writelines(batch)
+                        batch.clear()
+                    if not wanted:
+                        break
+            f_out.writelines(batch)
     except FileNotFoundError:
-        print(f"ERROR: Validation list file not found at {args.validation_list}. Aborting.")
+        print(f"ERROR: Master SCP file not found at {args.master_scp}. Aborting.")
         return
 
+    lines_missing = len(wanted)
+    for uid in sorted(wanted):
+        print(f"Warning: UID '{uid}' from validation list was not found in the master SCP. Skipping.")
+
     print("\n--- Reconstruction Complete ---")
     print(f"  Successfully reconstructed {lines_reconstructed} lines.")
     if lines_missing > 0:
@@ -2,10 +2,10 @@
 # Apache-2.0
 
 import os
-import random
-import shutil
 import argparse
-from itertools import zip_longest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 def create_validation_set(source_dir, val_dir, min_utts=1000, max_utts_per_speaker=None, balance_gender=True, random_seed=42):
     """
@@ -28,7 +28,7 @@ def create_validation_set(source_dir, val_dir, min_utts=1000, max_utts_per_speak
                                Requires a 'spk2gender' file in the source directory.
         random_seed (int): Seed for the random number generator to ensure deterministic splits.
     """
-    random.seed(random_seed)
+    rng = np.random.default_rng(random_seed)
 
     print(f"Source directory: {source_dir}")
     print(f"Validation directory: {val_dir}")
@@ -60,7 +60,7 @@ def create_validation_set(source_dir, val_dir, min_utts=1000, max_utts_per_speak
     speaker_utt_counts = {}
     all_speakers = []
 
-    with open(spk2utt_path, 'r', encoding='utf-8') as f:
+    with open(spk2utt_path, 'r', encoding='utf-8', buffering=1 << 20) as f:
         for line in f:
             parts = line.strip().split()
             speaker_id = parts[0]
@@ -81,21 +81,30 @@ def create_validation_set(source_dir, val_dir, min_utts=1000, max_utts_per_speak
             balance_gender = False
         else:
             print("\nReading spk2gender for gender balancing...")
-            with open(spk2gender_path, 'r', encoding='utf-8') as f:
+            with open(spk2gender_path, 'r', encoding='utf-8', buffering=1 << 20) as f:
                 for line in f:
                     parts = line.strip().split()
                     speaker_to_gender[parts[0]] = parts[1]
 
     # --- 3. Filter speakers based on max_utts_per_speaker ---
+    # Speaker metadata is kept as parallel arrays (ids, counts, genders) so
+    # the eligibility filter and gender split are vectorized boolean masks.
     print(f"\nFiltering speakers...")
-    eligible_speakers = [
-        spk for spk in all_speakers
-        if max_utts_per_speaker is None or speaker_utt_counts[spk] <= max_utts_per_speaker
-    ]
-    if not eligible_speakers:
+    spk_ids = np.array(all_speakers)
+    counts = np.fromiter(
+        (speaker_utt_counts[spk] for spk in all_speakers),
+        dtype=np.int64, count=len(all_speakers)
+    )
+    if max_utts_per_speaker is None:
+        eligible_mask = np.ones(len(spk_ids), dtype=bool)
+    else:
+        eligible_mask = counts <= max_utts_per_speaker
+    eligible_ids = spk_ids[eligible_mask]
+    eligible_counts = counts[eligible_mask]
+    if eligible_ids.size == 0:
         print("Error: No speakers match the specified criteria (e.g., --max_utts_per_speaker).")
         return
-    print(f"Found {len(eligible_speakers)} eligible speakers for validation set.")
+    print(f"Found {eligible_ids.size} eligible speakers for validation set.")
 
     # --- 4. Select speakers for the validation set ---
     validation_speakers = set()
@@ -104,30 +113,37 @@ def create_validation_set(source_dir, val_dir, min_utts=1000, max_utts_per_speak
 
     if balance_gender:
         print("\nAttempting gender-balanced selection...")
-        eligible_males = [spk for spk in eligible_speakers if speaker_to_gender.get(spk, 'f') == 'm']
-        eligible_females = [spk for spk in eligible_speakers if speaker_to_gender.get(spk, 'm') == 'f']
-        random.shuffle(eligible_males)
-        random.shuffle(eligible_females)
-        print(f"Found {len(eligible_males)} eligible male and {len(eligible_females)} eligible female speakers.")
-
-        # Alternate between adding male and female speakers
-        for male_spk, female_spk in zip_longest(eligible_males, eligible_females):
-            if current_utt_count >= min_utts:
-                break
-            # Add a male speaker if available
-            if male_spk and male_spk not in validation_speakers:
-                validation_speakers.add(male_spk)
-                validation_utterances.update(speaker_to_utts[male_spk])
-                current_utt_count += speaker_utt_counts[male_spk]
-            # Add a female speaker if available
-            if female_spk and female_spk not in validation_speakers:
-                validation_speakers.add(female_spk)
-                validation_utterances.update(speaker_to_utts[female_spk])
-                current_utt_count += speaker_utt_counts[female_spk]
+        genders = np.array(
+            [speaker_to_gender.get(spk, 'u') for spk in all_speakers]
+        )[eligible_mask]
+        male_idx = np.flatnonzero(genders == 'm')
+        female_idx = np.flatnonzero(genders == 'f')
+        rng.shuffle(male_idx)
+        rng.shuffle(female_idx)
+        print(f"Found {male_idx.size} eligible male and {female_idx.size} eligible female speakers.")
+
+        # Alternate between male and female speakers, then take the shortest
+        # prefix of the interleaved order whose cumulative utterance count
+        # reaches min_utts instead of accumulating per speaker in Python.
+        k = max(male_idx.size, female_idx.size)
+        inter_idx = np.full(2 * k, -1, dtype=np.int64)
+        inter_idx[0:2 * male_idx.size:2] = male_idx
+        inter_idx[1:2 * female_idx.size + 1:2] = female_idx
+        inter_idx = inter_idx[inter_idx >= 0]
+
+        csum = np.cumsum(eligible_counts[inter_idx])
+        if min_utts <= 0 or inter_idx.size == 0:
+            n_selected = 0
+        else:
+            n_selected = min(int(np.searchsorted(csum, min_utts)) + 1, inter_idx.size)
+
+        validation_speakers.update(eligible_ids[inter_idx[:n_selected]].tolist())
+        for spk in validation_speakers:
+            validation_utterances.update(speaker_to_utts[spk])
+        current_utt_count = int(csum[n_selected - 1]) if n_selected else 0
     else:
         print(f"\nSelecting speakers randomly for validation set (target size >= {min_utts} utterances)...")
-        random.shuffle(eligible_speakers)
-        for speaker in eligible_speakers:
+        for speaker in rng.permutation(eligible_ids).tolist():
             if current_utt_count >= min_utts:
                 break
             validation_speakers.add(speaker)
@@ -152,7 +168,14 @@ def create_validation_set(source_dir, val_dir, min_utts=1000, max_utts_per_speak
     utt_keyed_files = ['text', 'utt2category', 'utt2fs', 'utt2spk', 'wav.scp']
     spk_keyed_files = ['spk2utt', 'spk2gender', 'spk1.csp'] # Add any other speaker-keyed files here
 
-    for filename in kaldi_files:
+    # Freeze the membership sets once before the hot per-line loops. Unknown
+    # files check a single combined set so each line costs one hash probe.
+    val_utts = frozenset(validation_utterances)
+    val_spks = frozenset(validation_speakers)
+    val_keys = val_utts | val_spks
+
+    def split_file(filename):
+        """Streams one kaldi file once, routing each line to train or val."""
         print(f"  Processing '{filename}'...")
         original_path = os.path.join(source_dir, filename)
         train_path_tmp = os.path.join(source_dir, f"{filename}.tmp")
@@ -166,19 +189,23 @@ def create_validation_set(source_dir, val_dir, min_utts=1000, max_utts_per_speak
         elif file_base in spk_keyed_files:
             key_type = 'spk'
 
-        with open(original_path, 'r', encoding='utf-8') as f_in, \
-             open(train_path_tmp, 'w', encoding='utf-8') as f_train, \
-             open(val_path, 'w', encoding='utf-8') as f_val:
+        with open(original_path, 'r', encoding='utf-8', buffering=1 << 20) as f_in, \
+             open(train_path_tmp, 'w', encoding='utf-8', buffering=1 << 20) as f_train, \
+             open(val_path, 'w', encoding='utf-8', buffering=1 << 20) as f_val:
 
             for line in f_in:
-                key = line.strip().split(maxsplit=1)[0]
+                # partition is cheaper than strip().split() on this hot loop;
+                # only keyless lines need the newline trimmed off.
+                key, sep, _ = line.partition(' ')
+                if not sep:
+                    key = key.rstrip()
                 is_in_val = False
                 if key_type == 'utt':
-                    if key in validation_utterances: is_in_val = True
+                    if key in val_utts: is_in_val = True
                 elif key_type == 'spk':
-                    if key in validation_speakers: is_in_val = True
-                else: # Fallback for unknown files: check both sets
-                    if key in validation_utterances or key in validation_speakers:
+                    if key in val_spks: is_in_val = True
+                else: # Fallback for unknown files: utterance and speaker keys
+                    if key in val_keys:
                         is_in_val = True
 
                 # Write to the appropriate file
@@ -187,13 +214,19 @@ def create_validation_set(source_dir, val_dir, min_utts=1000, max_utts_per_speak
                 else:
                     f_train.write(line)
 
+    # Each file is routed independently, so split them concurrently; the GIL
+    # is released during file I/O, letting the reads/writes overlap.
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for future in [executor.submit(split_file, f) for f in kaldi_files]:
+            future.result()
+
     # --- 6. Replace original files with the new, smaller training files ---
     print("\nFinalizing training set files...")
     for filename in kaldi_files:
         original_path = os.path.join(source_dir, filename)
         train_path_tmp = os.path.join(source_dir, f"{filename}.tmp")
         # Overwrite the original file with the temporary file
-        shutil.move(train_path_tmp, original_path)
+        os.replace(train_path_tmp, original_path)
 
     print("\nValidation set creation complete!")
     print(f"Training data is updated in: {source_dir}")
@@ -3,60 +3,101 @@
 
 from tqdm import tqdm
 from pathlib import Path
-import pandas as pd
 import argparse
+import csv
 
 
-def filter_curation_list(info, curation_list, exclude=False):
+def load_curation_sets(curation_path):
     """
-    Filters a list of audio samples based on a curation list.
+    Loads the 'uid' and 'filename' columns of a curation CSV into sets.
+
+    Only the two relevant columns are kept, so a large curation list does
+    not need a full DataFrame in memory.
 
     Args:
-        info (dict): A dictionary mapping UIDs to audio file paths.
-        curation_list (pd.DataFrame): A DataFrame with a 'uid' or 'filename' column.
-        exclude (bool): If True, excludes samples in the curation list.
-                        If False, includes only samples in the curation list.
+        curation_path (str): Path to the curation list file (CSV format).
 
     Returns:
-        list: A list of UIDs that pass the filter.
+        tuple: (number of rows, set of uids, set of filenames).
     """
-    # Create sets of curated items for efficient lookup.
-    has_uid = 'uid' in curation_list.columns
+    num_rows = 0
     curated_uids = set()
-    if has_uid:
-        curated_uids = set(curation_list['uid'])
-
-    has_filename = 'filename' in curation_list.columns
     curated_filenames = set()
-    if has_filename:
-        curated_filenames = set(curation_list['filename'])
+    with open(curation_path, "r", newline="", buffering=1 << 20) as f:
+        reader = csv.DictReader(f)
+        has_uid = 'uid' in (reader.fieldnames or [])
+        has_filename = 'filename' in (reader.fieldnames or [])
+        for row in reader:
+            num_rows += 1
+            if has_uid:
+                curated_uids.add(row['uid'])
+            if has_filename:
+                curated_filenames.add(row['filename'])
+    return num_rows, curated_uids, curated_filenames
+
+
+def filter_scp_stream(scp_path, outfile, curated_uids, curated_filenames, exclude=False):
+    """
+    Filters an scp file against a curation list in a single streaming pass.
+
+    Each scp line is tested for membership while it is read and written
+    straight to the output file, so no intermediate dict of all samples is
+    kept in memory.
 
+    Args:
+        scp_path (str): Path to the input scp file.
+        outfile (str): Path to the output scp file.
+        curated_uids (set): UIDs from the curation list (may be empty).
+        curated_filenames (set): Filenames from the curation list (may be empty).
+        exclude (bool): If True, excludes samples in the curation list.
+                        If False, includes only samples in the curation list.
+
+    Returns:
+        tuple: (number of input lines, number of lines kept).
+    """
     if not curated_uids and not curated_filenames:
         raise ValueError("Curation list must contain either a 'uid' or 'filename' column.")
 
-    filtered_uids = []
-    # Iterate over the main list of samples (info)
-    for uid, path in tqdm(info.items(), desc="Filtering samples"):
-        filename = Path(path).name
-
-        # Check if the sample is in the curation list by either uid or filename
-        if has_uid:
-            is_curated = uid in curated_uids
-        elif has_filename:
-            is_curated = filename in curated_filenames
-        else:
-            raise ValueError("Curation list must contain either a 'uid' or 'filename' column.")
+    has_uid = bool(curated_uids)
 
+    total = 0
+    kept = 0
+    with open(scp_path, "r", buffering=1 << 20) as f_in, \
+            open(outfile, "w", buffering=1 << 20) as f_out, \
+            tqdm(desc="Filtering samples", unit=" samples") as pbar:
+        # The uid/filename mode is fixed for the whole file, so pick the loop
+        # body once instead of re-branching (and building a Path) per sample.
+        # The progress bar is only ticked every 10k samples; per-line tqdm
+        # updates are measurable on multi-million-line scps.
         # If in exclude mode, keep the sample if it's NOT curated.
         # If in include mode (default), keep the sample if it IS curated.
-        if exclude:
-            if not is_curated:
-                filtered_uids.append(uid)
+        if has_uid:
+            for line in f_in:
+                line = line.strip()
+                if not line:
+                    continue
+                total += 1
+                uid, path = line.split(maxsplit=1)
+                if (uid in curated_uids) != exclude:
+                    f_out.write(f"{uid} {path}\n")
+                    kept += 1
+                if total % 10000 == 0:
+                    pbar.update(10000)
         else:
-            if is_curated:
-                filtered_uids.append(uid)
-                
-    return filtered_uids
+            for line in f_in:
+                line = line.strip()
+                if not line:
+                    continue
+                total += 1
+                uid, path = line.split(maxsplit=1)
+                if (Path(path).name in curated_filenames) != exclude:
+                    f_out.write(f"{uid} {path}\n")
+                    kept += 1
+                if total % 10000 == 0:
+                    pbar.update(10000)
+        pbar.update(total % 10000)
+
+    return total, kept
 
 
 if __name__ == "__main__":
@@ -86,25 +127,17 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    curation_list = pd.read_csv(args.curation_path, low_memory=False)
-
-    info = {}
-    with open(args.scp_path, "r") as f:
-        for line in f:
-            uid, audio_path = line.strip().split()
-            info[uid] = audio_path
-    print(f"Loaded {len(info)} unique samples from {args.scp_path}")
-    
-    uids = filter_curation_list(info, curation_list, exclude=args.exclude)
-    
-    mode_text = "Excluding" if args.exclude else "Including"
-    print(f"Filtering mode: {mode_text}. Based on {len(curation_list)} curation entries: {len(info)} samples -> {len(uids)} samples")
+    # Create sets of curated items for efficient lookup.
+    num_entries, curated_uids, curated_filenames = load_curation_sets(args.curation_path)
 
     outdir = Path(args.outfile).parent
     outdir.mkdir(parents=True, exist_ok=True)
-    with Path(args.outfile).open("w") as f:
-        for uid in uids:
-            if uid in info:
-                f.write(f"{uid} {info[uid]}\n")
-    
-    print(f"Filtered list saved to {args.outfile}")
\ No newline at end of file
+
+    total, kept = filter_scp_stream(
+        args.scp_path, args.outfile, curated_uids, curated_filenames, exclude=args.exclude
+    )
+
+    mode_text = "Excluding" if args.exclude else "Including"
+    print(f"Filtering mode: {mode_text}. Based on {num_entries} curation entries: {total} samples -> {kept} samples")
+
+    print(f"Filtered list saved to {args.outfile}")
@@ -6,15 +6,79 @@ import os
 import shutil
 import subprocess
 import sys
-from multiprocessing import Pool, cpu_count
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+
+import soundfile as sf
 from tqdm import tqdm
 
+# Resolved ffmpeg binary path, set once per worker process by _init_worker.
+_FFMPEG = "ffmpeg"
+
+def _init_worker(ffmpeg_path):
+    """Pool initializer: stores the ffmpeg path resolved in the parent."""
+    global _FFMPEG
+    if ffmpeg_path:
+        _FFMPEG = ffmpeg_path
+
+def _convert_with_ffmpeg(input_path, wav_path):
+    """
+    Fallback conversion for formats libsndfile cannot decode.
+
+    Only reached when soundfile fails, so the per-file ffmpeg startup cost
+    is paid for the rare problematic inputs instead of every utterance.
+    """
+    command = [
+        _FFMPEG, "-i", str(input_path), "-y",
+        "-hide_banner", "-loglevel", "error", str(wav_path)
+    ]
+    subprocess.run(command, check=True, capture_output=True, text=True)
+
+def filter_keyed_file(keys_file, keys, in_path, out_path):
+    """
+    Keeps only the lines of in_path whose first field appears in keys.
+
+    The line loop is delegated to awk (set membership on the first field in
+    native code), which is much faster than Python on multi-GB text/utt2spk
+    files; if awk is unavailable, the lines are filtered in Python instead.
+
+    Args:
+        keys_file (Path): File with one key per line (for awk).
+        keys (set): The same keys as a Python set (for the fallback).
+        in_path (Path): The file to filter.
+        out_path (Path): Where to write the kept lines.
+
+    Returns:
+        int: The number of lines kept.
+    """
+    try:
+        with open(out_path, 'w', encoding='utf-8', buffering=1 << 20) as outfile:
+            subprocess.run(
+                ["awk", "NR==FNR {keep[$1]; next} $1 in keep",
+                 str(keys_file), str(in_path)],
+                check=True, stdout=outfile,
+            )
+        with open(out_path, 'r', encoding='utf-8', buffering=1 << 20) as outfile:
+            return sum(1 for _ in outfile)
+    except (OSError, subprocess.CalledProcessError):
+        lines_kept = 0
+        with open(in_path, 'r', encoding='utf-8', buffering=1 << 20) as infile, \
+             open(out_path, 'w', encoding='utf-8', buffering=1 << 20) as outfile:
+            for line in infile:
+                if line.strip().split(maxsplit=1)[0] in keys:
+                    outfile.write(line)
+                    lines_kept += 1
+        return lines_kept
+
 def convert_worker_inplace(task):
     """
     Worker for in-place conversion: converts non-WAV files to WAV, then deletes the original.
     If the file is already a WAV, it is skipped and its path is returned.
 
+    The conversion is done in-process with soundfile (libsndfile) instead of
+    spawning one ffmpeg process per file, so each worker pays no fork/exec or
+    ffmpeg startup cost per utterance.
+
     Args:
         task (tuple): A tuple containing (utterance_id, file_path, middle_cols).
 
@@ -23,7 +87,7 @@ def convert_worker_inplace(task):
     """
     utterance_id, path_str, middle_cols = task
     input_path = Path(path_str)
-    
+
     if input_path.suffix.lower() == '.wav':
         return (utterance_id, str(input_path.resolve()), middle_cols)
 
@@ -34,11 +98,13 @@ def convert_worker_inplace(task):
 
         wav_path = input_path.with_suffix('.wav')
 
-        command = [
-            "ffmpeg", "-i", str(input_path), "-y",
-            "-hide_banner", "-loglevel", "error", str(wav_path)
-        ]
-        subprocess.run(command, check=True, capture_output=True, text=True)
+        try:
+            data, sr = sf.read(str(input_path), dtype='int16', always_2d=False)
+            sf.write(str(wav_path), data, sr, subtype='PCM_16')
+        except Exception:
+            # libsndfile does not handle every codec; retry the single bad
+            # file through ffmpeg before giving up on it.
+            _convert_with_ffmpeg(input_path, wav_path)
 
         input_path.unlink()
 
@@ -66,7 +132,7 @@ def main():
         help="Path to the input scp file (e.g., wav.scp) with audio paths."
     )
     parser.add_argument(
-        "-j", "--num-workers", type=int, default=cpu_count(),
+        "-j", "--num-workers", type=int, default=os.cpu_count(),
         help="Number of parallel processes to use. (default: number of CPU cores)"
     )
     parser.add_argument(
@@ -78,7 +144,7 @@ def main():
 
     print(f"Reading tasks from {args.input_scp}...")
     tasks = []
-    with open(args.input_scp, 'r', encoding='utf-8') as f:
+    with open(args.input_scp, 'r', encoding='utf-8', buffering=1 << 20) as f:
         for line in f:
             line = line.strip()
             if not line: continue
@@ -87,7 +153,10 @@ def main():
             if len(parts) >= 2:
                 utterance_id = parts[0]
                 file_path = parts[-1]
-                middle_cols = parts[1:-1]
+                # Middle columns are typically empty or the same sample-rate
+                # token on every line; interned tuples keep one shared object
+                # per distinct token and pickle smaller for the worker IPC.
+                middle_cols = tuple(sys.intern(col) for col in parts[1:-1])
                 tasks.append((utterance_id, file_path, middle_cols))
             else:
                 print(f"Warning: Skipping malformed line: {line}")
@@ -96,14 +165,34 @@ def main():
         print("No valid tasks found. Exiting.")
         return
 
-    print(f"Found {len(tasks)} files to process. Starting conversion with {args.num_workers} workers...")
+    # Files that are already WAV are pure no-ops; resolve them inline instead
+    # of paying the pool IPC round-trip for each of them.
     new_scp_entries = []
-    with Pool(processes=args.num_workers) as pool:
-        with tqdm(total=len(tasks), desc="Processing files") as pbar:
-            for result in pool.imap_unordered(convert_worker_inplace, tasks):
-                if result:
-                    new_scp_entries.append(result)
-                pbar.update(1)
+    convert_tasks = []
+    for utterance_id, file_path, middle_cols in tasks:
+        input_path = Path(file_path)
+        if input_path.suffix.lower() == '.wav':
+            new_scp_entries.append((utterance_id, str(input_path.resolve()), middle_cols))
+        else:
+            convert_tasks.append((utterance_id, file_path, middle_cols))
+
+    print(f"Found {len(tasks)} files ({len(new_scp_entries)} already WAV). "
+          f"Starting conversion with {args.num_workers} workers...")
+    if convert_tasks:
+        # Hand tasks to the workers in batches; the default chunksize of 1
+        # pays one IPC round-trip per tiny task tuple.
+        chunksize = max(1, min(64, len(convert_tasks) // (args.num_workers * 4)))
+        with ProcessPoolExecutor(
+            max_workers=args.num_workers,
+            initializer=_init_worker,
+            initargs=(shutil.which("ffmpeg"),),
+        ) as executor:
+            with tqdm(total=len(convert_tasks), desc="Processing files",
+                      miniters=100, mininterval=0.5) as pbar:
+                for result in executor.map(convert_worker_inplace, convert_tasks, chunksize=chunksize):
+                    if result:
+                        new_scp_entries.append(result)
+                    pbar.update(1)
 
     new_scp_entries.sort(key=lambda x: x[0])
     successful_utts = {utt_id for utt_id, _, _ in new_scp_entries}
@@ -111,15 +200,18 @@ def main():
     print("\nUpdating script files...")
 
     temp_scp_path = Path(args.input_scp).with_suffix('.tmp')
-    with open(temp_scp_path, 'w', encoding='utf-8') as f:
+    with open(temp_scp_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
         for utterance_id, wav_path, middle_cols in new_scp_entries:
-            line_parts = [utterance_id] + middle_cols + [wav_path]
-            f.write(" ".join(line_parts) + "\n")
+            f.write(" ".join((utterance_id, *middle_cols, wav_path)) + "\n")
             
-    shutil.move(str(temp_scp_path), args.input_scp)
+    os.replace(temp_scp_path, args.input_scp)
     print(f"  -> Updated {args.input_scp}")
 
     if args.extra_files:
+        utts_file = Path(args.input_scp).with_suffix('.utts.tmp')
+        with open(utts_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            f.writelines(f"{utt_id}\n" for utt_id in successful_utts)
+
         for file_path_str in args.extra_files:
             file_path = Path(file_path_str)
             if not file_path.exists():
@@ -127,17 +219,14 @@ def main():
                 continue
 
             temp_extra_path = file_path.with_suffix('.tmp')
-            lines_kept = 0
-            with open(file_path, 'r', encoding='utf-8') as infile, \
-                 open(temp_extra_path, 'w', encoding='utf-8') as outfile:
-                for line in infile:
-                    if line.strip().split(maxsplit=1)[0] in successful_utts:
-                        outfile.write(line)
-                        lines_kept += 1
-            
-            shutil.move(str(temp_extra_path), str(file_path))
+            lines_kept = filter_keyed_file(
+                utts_file, successful_utts, file_path, temp_extra_path
+            )
+            os.replace(temp_extra_path, file_path)
             print(f"  -> Updated {file_path} (kept {lines_kept} lines)")
 
+        utts_file.unlink()
+
     print("\nOperation complete!")
     print(f"Successfully processed {len(new_scp_entries)} out of {len(tasks)} files.")
 
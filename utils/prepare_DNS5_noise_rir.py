@@ -2,16 +2,67 @@
 # Apache-2.0
 
 import os
+import shutil
 import subprocess
 import tarfile
 import requests
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
-from collections import defaultdict
-import glob
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from filter_via_curation_list import load_curation_sets
+
+
+def open_tar_stream(archive_path: Path):
+    """
+    Opens a .tar.bz2 archive for reading, using a parallel bzip2 tool for
+    decompression when one is installed.
+
+    lbzip2/pbzip2 split the bz2 stream at block boundaries and inflate the
+    blocks across all cores, while the tar layer reads the resulting stream
+    forward-only; Python's single-threaded bz2 reader is the fallback. Both
+    paths open in streaming mode ("r|"), so the compressed data is read and
+    inflated exactly once, with no seeking and no up-front member list.
+
+    Returns:
+        tuple: (tarfile.TarFile, subprocess.Popen or None). The caller must
+        close the tarfile and wait on the process if one was started.
+    """
+    for tool in ("lbzip2", "pbzip2"):
+        if shutil.which(tool):
+            proc = subprocess.Popen(
+                [tool, "-dc", str(archive_path)], stdout=subprocess.PIPE
+            )
+            return tarfile.open(fileobj=proc.stdout, mode="r|"), proc
+    archive_file = open(archive_path, "rb")
+    if hasattr(os, "posix_fadvise"):
+        # The archive is read front to back exactly once; telling the kernel
+        # lets it read ahead aggressively and drop pages behind the reader.
+        os.posix_fadvise(
+            archive_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL
+        )
+    return tarfile.open(fileobj=archive_file, mode="r|bz2"), None
+
+def iter_audio_files(root: Path, suffix: str):
+    """
+    Yields every file under root whose name ends with suffix.
+
+    Walks the tree with os.scandir on an explicit stack: each entry's type
+    comes back from the directory read itself, so no per-file stat calls are
+    made, unlike Path.rglob which stats every entry it matches.
+    """
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    yield Path(entry.path)
+
 
 output_dir = Path("./dns5_fullband")
 base_download_url = "https://dnschallengepublic.blob.core.windows.net/dns5archive/V5_training_dataset"
+# 1 MiB download chunks: tiny chunks make iter_content Python-overhead-bound
+DOWNLOAD_CHUNK_SIZE = 1 << 20
 tmp_dir = Path("tmp")
 curation_file = './datafiles/dns5_noise/train_meta_curated.csv'
 
@@ -35,6 +86,65 @@ blob_names_to_download = [
     "datasets_fullband.impulse_responses_000.tar.bz2",
 ]
 
+# One session shared by all download threads: the TLS context and pooled
+# connections to the blob host are reused instead of each requests.get call
+# building a fresh adapter and handshaking from scratch. Transient server
+# errors are retried with backoff instead of killing an hours-long download
+# run on the first 503.
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    requests.adapters.HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=64,
+        max_retries=requests.adapters.Retry(
+            total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+        ),
+    ),
+)
+
+# Connections per file for ranged downloads; a single HTTPS stream to the
+# blob host is throttled well below what several streams achieve together.
+RANGE_CONNECTIONS = 4
+# Files below this size are not worth the extra round-trips.
+RANGE_MIN_SIZE = 64 << 20
+
+
+def _download_range(url: str, fd: int, start: int, stop: int):
+    """Fetches bytes [start, stop) of url and pwrites them into fd."""
+    headers = {"Range": f"bytes={start}-{stop - 1}"}
+    with SESSION.get(url, headers=headers, stream=True) as r:
+        r.raise_for_status()
+        offset = start
+        for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+
+
+def download_ranged(url: str, local_path: Path, total_size: int):
+    """
+    Downloads url into local_path over several concurrent range requests.
+
+    The file is preallocated and each connection pwrites its slice directly
+    at the right offset, so no reassembly pass is needed afterwards.
+    """
+    bounds = [
+        total_size * i // RANGE_CONNECTIONS for i in range(RANGE_CONNECTIONS + 1)
+    ]
+    fd = os.open(local_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC)
+    try:
+        os.truncate(fd, total_size)
+        with ThreadPoolExecutor(max_workers=RANGE_CONNECTIONS) as executor:
+            futures = [
+                executor.submit(_download_range, url, fd, bounds[i], bounds[i + 1])
+                for i in range(RANGE_CONNECTIONS)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+
+
 def download_file(blob_name: str):
     """Downloads a single file from the blob storage."""
     url = f"{base_download_url}/{blob_name}"
@@ -48,116 +158,173 @@ def download_file(blob_name: str):
 
     try:
         print(f"Downloading {url} to {local_path}")
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        # Probe whether the server supports range requests; if it does and
+        # the blob is large, split it across several connections.
+        head = SESSION.head(url, allow_redirects=True)
+        head.raise_for_status()
+        total_size = int(head.headers.get("Content-Length", 0))
+        accepts_ranges = head.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+        if accepts_ranges and total_size >= RANGE_MIN_SIZE:
+            download_ranged(url, local_path, total_size)
+        else:
+            with SESSION.get(url, stream=True) as r:
+                r.raise_for_status()
+                with open(local_path, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
         print(f"Finished downloading {blob_name}")
     except requests.exceptions.RequestException as e:
         print(f"Error downloading {blob_name}: {e}")
         raise
 
-with ThreadPoolExecutor(max_workers=8) as executor:
-    futures = [executor.submit(download_file, blob_name) for blob_name in blob_names_to_download]
-    for future in futures:
+transform_prefix = "datasets_fullband/noise_fullband/"
+
+
+def extract_archive(archive_path: Path, xdir: Path, strip_prefix: str = None):
+    """Extracts one archive into xdir, optionally stripping a path prefix."""
+    print(f"Extracting {archive_path}")
+    try:
+        if not archive_path.exists():
+            raise FileNotFoundError(archive_path)
+        tar, proc = open_tar_stream(archive_path)
+        # Archive members are grouped by directory, so remember which parents
+        # have been created instead of issuing a mkdir syscall per file.
+        seen_dirs = set()
+        try:
+            # Iterate the tar forward-only so the (possibly piped)
+            # stream is read in a single pass.
+            for member in tar:
+                if member.isreg():
+                    if strip_prefix and member.name.startswith(strip_prefix):
+                        transformed_name = Path(member.name).relative_to(strip_prefix)
+                    else:
+                        transformed_name = Path(member.name)
+
+                    target_file_path = xdir / transformed_name
+                    parent_dir = target_file_path.parent
+                    if parent_dir not in seen_dirs:
+                        parent_dir.mkdir(parents=True, exist_ok=True)
+                        seen_dirs.add(parent_dir)
+
+                    with tar.extractfile(member) as source_file:
+                        if source_file:
+                            with open(target_file_path, "wb") as dest_file:
+                                # Stream through a fixed buffer instead of
+                                # loading the whole member into memory.
+                                shutil.copyfileobj(source_file, dest_file, length=1 << 20)
+                                if hasattr(os, "posix_fadvise"):
+                                    # The extracted wav will not be re-read
+                                    # here; drop its pages so hundreds of GB
+                                    # of output do not evict the page cache.
+                                    dest_file.flush()
+                                    os.posix_fadvise(
+                                        dest_file.fileno(), 0, 0,
+                                        os.POSIX_FADV_DONTNEED,
+                                    )
+        finally:
+            tar.close()
+            if proc is not None:
+                proc.stdout.close()
+                if proc.wait() != 0:
+                    raise RuntimeError(f"Parallel bzip2 decompression failed for {archive_path}")
+    except tarfile.ReadError as e:
+        print(f"Error extracting {archive_path}: {e}")
+    except FileNotFoundError:
+        print(f"Archive not found, skipping extraction: {archive_path}")
+
+
+# Every extraction task is derived from the blob list itself, so editing
+# that list is the only change needed to add or drop a shard; the RIR
+# archive goes through the same pool with no prefix stripped.
+extract_task_for = {}
+for blob_name in blob_names_to_download:
+    archive_path = output_dir / blob_name
+    if blob_name.startswith("noise_fullband/"):
+        # e.g. datasets_fullband.noise_fullband.audioset_000.tar.bz2
+        shard = Path(blob_name).name[: -len(".tar.bz2")].rsplit(".", 1)[-1]
+        xdir = output_dir / "datasets_fullband" / "noise_fullband" / shard
+        check_dir = xdir
+        strip_prefix = transform_prefix
+    else:
+        # RIR archive: its members already carry the datasets_fullband/ prefix.
+        xdir = output_dir
+        check_dir = output_dir / "datasets_fullband" / "impulse_responses"
+        strip_prefix = None
+
+    if check_dir.exists() and any(check_dir.iterdir()):
+        print(f"Directory already exists and is not empty, skipping extraction: {check_dir}")
+        continue
+
+    xdir.mkdir(parents=True, exist_ok=True)
+    extract_task_for[blob_name] = (archive_path, xdir, strip_prefix)
+
+# Downloads are network-bound and extraction is CPU-bound, so the two
+# stages are overlapped: as soon as a blob finishes downloading, its
+# extraction is handed to the process pool while the remaining blobs are
+# still in flight. Processes are needed on the extraction side because the
+# fallback bz2 decompression holds the GIL.
+extract_workers = max(1, min(len(extract_task_for) or 1, os.cpu_count() or 1))
+with ThreadPoolExecutor(max_workers=8) as dl_pool, \
+        ProcessPoolExecutor(max_workers=extract_workers) as extract_pool:
+    dl_futures = {
+        dl_pool.submit(download_file, blob_name): blob_name
+        for blob_name in blob_names_to_download
+    }
+    extract_futures = []
+    for future in as_completed(dl_futures):
+        blob_name = dl_futures[future]
         try:
             future.result()
         except Exception as exc:
             print(f"Download generated an exception: {exc}")
             exit(1)
-
-print("Extracting archives...")
-transform_prefix = "datasets_fullband/noise_fullband/"
-
-for sub in ["audioset", "freesound"]:
-    n = 6 if sub == "audioset" else 1
-    for idx in range(n + 1):
-        archive_name = f"noise_fullband/datasets_fullband.noise_fullband.{sub}_{idx:03d}.tar.bz2"
-        archive_path = output_dir / archive_name
-        xdir = output_dir / "datasets_fullband" / "noise_fullband" / f"{sub}_{idx:03d}"
-        
-        if xdir.exists() and any(xdir.iterdir()):
-            print(f"Directory already exists and is not empty, skipping extraction: {xdir}")
-            continue
-            
-        xdir.mkdir(parents=True, exist_ok=True)
-
-        print(f"Extracting {archive_path}")
+        task = extract_task_for.get(blob_name)
+        if task is not None:
+            print(f"Queueing extraction of {blob_name}")
+            extract_futures.append(extract_pool.submit(extract_archive, *task))
+    for future in extract_futures:
         try:
-            with tarfile.open(archive_path, "r:bz2") as tar:
-                for member in tar.getmembers():
-                    if member.isreg():
-                        relative_path_in_archive = Path(member.name)
-                        if str(relative_path_in_archive).startswith(transform_prefix):
-                            transformed_name = relative_path_in_archive.relative_to(transform_prefix)
-                        else:
-                            transformed_name = relative_path_in_archive
-
-                        target_file_path = xdir / transformed_name
-                        target_file_path.parent.mkdir(parents=True, exist_ok=True)
-
-                        with tar.extractfile(member) as source_file:
-                            if source_file:
-                                with open(target_file_path, "wb") as dest_file:
-                                    dest_file.write(source_file.read())
-        except tarfile.ReadError as e:
-            print(f"Error extracting {archive_path}: {e}")
-        except FileNotFoundError:
-            print(f"Archive not found, skipping extraction: {archive_path}")
-        except Exception as e:
-            print(f"An unexpected error occurred during extraction of {archive_path}: {e}")
+            future.result()
+        except Exception as exc:
+            print(f"An unexpected error occurred during extraction: {exc}")
             exit(1)
 
-rir_archive_name = "datasets_fullband.impulse_responses_000.tar.bz2"
-rir_archive_path = output_dir / rir_archive_name
-rir_extract_dir = output_dir
-
-print(f"Extracting {rir_archive_path}")
-rir_extracted_check_dir = rir_extract_dir / "datasets_fullband" / "impulse_responses"
-
-if rir_extracted_check_dir.exists() and any(rir_extracted_check_dir.iterdir()):
-    print(f"RIR directory already exists and is not empty, skipping extraction: {rir_extracted_check_dir}")
-else:
-    try:
-        with tarfile.open(rir_archive_path, "r:bz2") as tar:
-            tar.extractall(path=rir_extract_dir)
-    except tarfile.ReadError as e:
-        print(f"Error extracting {rir_archive_path}: {e}")
-    except FileNotFoundError:
-        print(f"Archive not found, skipping extraction: {rir_archive_path}")
-    except Exception as e:
-        print(f"An unexpected error occurred during extraction of {rir_archive_path}: {e}")
-        exit(1)
+filtered_scp_file = tmp_dir / "dns5_noise_filtered_curation.scp"
+resamp_scp_file = tmp_dir / "dns5_noise_resampled_filtered_curation.scp"
 
-noise_scp_file = tmp_dir / "dns5_noise.scp"
-if noise_scp_file.exists():
-    print(f"Noise scp file already exists. Skipping generation: {noise_scp_file}")
+if filtered_scp_file.exists():
+    print(f"Filtered scp file already exists. Delete {filtered_scp_file} if you want to re-estimate.")
 else:
-    print("[DNS5 noise and RIR] Generating scp file for noise")
+    print("[DNS5 noise and RIR] Generating curated scp file for noise")
     noise_base_dir = output_dir / "datasets_fullband" / "noise_fullband"
-    noise_lines = []
     if noise_base_dir.exists():
-        wav_files = sorted(list(noise_base_dir.rglob("*.wav")))
+        # Curation membership is checked while the tree is walked, so the
+        # curated scp comes out of a single pass with no intermediate full
+        # scp to write, re-read and filter.
+        num_entries, curated_uids, curated_filenames = load_curation_sets(curation_file)
+        wav_files = sorted(iter_audio_files(noise_base_dir, ".wav"))
         print(f"Found {len(wav_files)} raw noise .wav files.")
+        noise_lines = []
         for wav_path in wav_files:
-            try:
-                file_id = wav_path.stem
-                noise_lines.append(f"{file_id} {wav_path.resolve()}\n")
-            except ValueError:
-                print(f"Warning: Could not determine relative path for {wav_path}. Skipping.")
-                continue
-
-        with open(noise_scp_file, "w") as f_scp:
-            f_scp.writelines(noise_lines)
-        print(f"Created noise scp file: {noise_scp_file}")
+            file_id = wav_path.stem
+            if curated_uids:
+                keep = file_id in curated_uids
+            else:
+                keep = wav_path.name in curated_filenames
+            if keep:
+                # abspath is a pure string operation; resolve() stats every
+                # path component to chase symlinks, which adds up here.
+                noise_lines.append(f"{file_id} {os.path.abspath(wav_path)}\n")
+
+        with open(filtered_scp_file, "w") as f_scp:
+            f_scp.write("".join(noise_lines))
+        print(f"Kept {len(noise_lines)} of {len(wav_files)} files "
+              f"based on {num_entries} curation entries: {filtered_scp_file}")
     else:
-        print(f"Error: Noise base directory not found: {noise_base_dir}. Cannot generate raw noise scp.")
+        print(f"Error: Noise base directory not found: {noise_base_dir}. Cannot generate noise scp.")
         exit(1)
 
-filtered_scp_file = tmp_dir / "dns5_noise_filtered_curation.scp"
-resamp_scp_file = tmp_dir / "dns5_noise_resampled_filtered_curation.scp"
-
 def run_external_python_script(script_path: str, args: list, env_vars: dict = None):
     """Helper function to run external Python scripts."""
     full_command = ["python", script_path] + args
@@ -166,28 +333,14 @@ def run_external_python_script(script_path: str, args: list, env_vars: dict = No
     if env_vars:
         process_env.update(env_vars)
     try:
-        subprocess.run(full_command, check=True, env=process_env, capture_output=True, text=True)
+        # Let the child inherit stdout/stderr: capturing would buffer its
+        # whole output in memory and hide its progress bars until exit.
+        subprocess.run(full_command, check=True, env=process_env)
         print(f"Successfully ran {script_path}")
     except subprocess.CalledProcessError as e:
         print(f"Error running {script_path}: {e}")
-        print(f"Stdout: {e.stdout}")
-        print(f"Stderr: {e.stderr}")
         exit(1)
 
-if filtered_scp_file.exists():
-    print(f"Filtered scp file already exists. Delete {filtered_scp_file} if you want to re-estimate.")
-else:
-    print("[DNS5 noise and RIR] filtering using curation lists")
-    run_external_python_script(
-        "utils/filter_via_curation_list.py",
-        [
-            "--scp_path", str(noise_scp_file),
-            "--curation_path", str(curation_file),
-            "--outfile", str(filtered_scp_file)
-        ],
-        env_vars={"OMP_NUM_THREADS": "1"}
-    )
-
 if resamp_scp_file.exists():
     print(f"Resampled scp file already exists. Delete {resamp_scp_file} if you want to re-resample.")
 else:
@@ -208,14 +361,12 @@ else:
 
 print("[DNS5 noise and RIR] preparing data files")
 
-noise_data_by_fs = defaultdict(list)
+# The per-sampling-rate grouping that used to live here was flattened
+# straight back into one list, so the split was pure overhead; the lines
+# only need to come out sorted.
 try:
-    with open(resamp_scp_file, "r") as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) > 1:
-                sampling_rate = parts[1]
-                noise_data_by_fs[sampling_rate].append(line)
+    with open(resamp_scp_file, "r", buffering=1 << 20) as f:
+        all_files = f.readlines()
 except FileNotFoundError:
     print(f"Error: Required file {resamp_scp_file} not found. Cannot split noise data.")
     exit(1)
@@ -223,13 +374,9 @@ except Exception as e:
     print(f"An error occurred while reading {resamp_scp_file}: {e}")
     exit(1)
 
-all_files = []
-for fs, lst in noise_data_by_fs.items():
-    all_files.extend(lst)
-
+all_files.sort()
 with open(tmp_dir / "dns5_noise_resampled_filtered_curation.scp", "w") as f:
-    for line in sorted(all_files):
-        f.write(line)
+    f.write("".join(all_files))
 print("Created dns5_noise_resampled_filtered_curation.scp")
 
 print("--- Starting RIR Data Processing ---")
@@ -238,10 +385,12 @@ if not rir_scp_file.exists():
     print("[RIR] Generating raw scp file...")
     rir_base_dir = output_dir / "datasets_fullband" / "impulse_responses"
     if rir_base_dir.exists():
+        rir_lines = [
+            f"{wav_path.stem} {os.path.abspath(wav_path)}\n"
+            for wav_path in sorted(iter_audio_files(rir_base_dir, ".wav"))
+        ]
         with open(rir_scp_file, "w") as f_scp:
-            for wav_path in sorted(rir_base_dir.rglob("*.wav")):
-                file_id = wav_path.stem
-                f_scp.write(f"{file_id} {wav_path.resolve()}\n")
+            f_scp.write("".join(rir_lines))
         print(f"Created raw RIR scp: {rir_scp_file}")
     else:
         print(f"Warning: RIR base directory not found: {rir_base_dir}. Skipping RIR prep.")
@@ -2,10 +2,15 @@
 # Apache-2.0
 
 import os
+import shutil
 import subprocess
 import requests
 import hashlib
+import zipfile
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from filter_via_curation_list import load_curation_sets
 
 # --- Configuration ---
 # Directories
@@ -18,10 +23,72 @@ FMA_METADATA_URL = "https://os.unil.cloud.switch.ch/fma/fma_metadata.zip"
 FMA_MEDIUM_URL = "https://os.unil.cloud.switch.ch/fma/fma_medium.zip"
 FMA_MEDIUM_SHA1 = "c67b69ea232021025fca9231fc1c7c1a063ab50b"
 
+# 1 MiB download chunks: tiny chunks make iter_content Python-overhead-bound
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
 curation_file = Path("./datafiles/fma/train_meta_curated.csv")
 
+# Shared session: connections to the mirror are pooled and reused, and
+# transient server errors are retried with backoff instead of killing an
+# hours-long download run on the first 503.
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    requests.adapters.HTTPAdapter(
+        max_retries=requests.adapters.Retry(
+            total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+        )
+    ),
+)
+
 # --- Helper Functions ---
 
+def iter_audio_files(root: Path, suffix: str):
+    """
+    Yields every file under root whose name ends with suffix.
+
+    Walks the tree with os.scandir on an explicit stack: each entry's type
+    comes back from the directory read itself, so no per-file stat calls are
+    made, unlike Path.rglob which stats every entry it matches.
+    """
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    yield Path(entry.path)
+
+def extract_zip_parallel(zip_path: Path, dest_dir: Path, max_workers: int = 8):
+    """
+    Extracts a zip archive with several threads.
+
+    Each worker opens its own ZipFile handle (a shared handle serializes all
+    reads on an internal lock), and the directory tree is created up front
+    so the copy loops never race on mkdir. zlib decompression releases the
+    GIL, so the workers genuinely overlap.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        names = zf.namelist()
+
+    for d in {os.path.dirname(name) for name in names}:
+        if d:
+            (dest_dir / d).mkdir(parents=True, exist_ok=True)
+
+    def worker(batch):
+        with zipfile.ZipFile(zip_path) as zf:
+            for name in batch:
+                if name.endswith("/"):
+                    continue
+                with zf.open(name) as src, open(dest_dir / name, "wb") as dst:
+                    shutil.copyfileobj(src, dst, length=1 << 20)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batches = [names[i::max_workers] for i in range(max_workers)]
+        for future in [executor.submit(worker, b) for b in batches]:
+            future.result()
+
 def run_external_command(command: list, env_vars: dict = None):
     """Helper function to run external commands."""
     print(f"Running command: {' '.join(map(str, command))}")
@@ -29,19 +96,17 @@ def run_external_command(command: list, env_vars: dict = None):
     if env_vars:
         process_env.update(env_vars)
     try:
+        # Let the child inherit stdout/stderr: capturing would buffer its
+        # whole output in memory and hide its progress bars until exit.
         result = subprocess.run(
             command,
             check=True,
-            env=process_env,
-            capture_output=True,
-            text=True
+            env=process_env
         )
         return result
     except subprocess.CalledProcessError as e:
         print(f"Error running command: {' '.join(map(str, command))}")
         print(f"Return Code: {e.returncode}")
-        print(f"Stdout: {e.stdout}")
-        print(f"Stderr: {e.stderr}")
         exit(1)
 
 # --- Main Script Logic ---
@@ -61,16 +126,23 @@ if __name__ == "__main__":
     if download_done_file.exists():
         print("Skip downloading FMA as it has already finished.")
     else:
-        # Download files
+        # Download files, hashing fma_medium.zip as its bytes arrive so the
+        # multi-GB archive is not read back from disk just to verify it.
+        medium_digest = None
         for url in [FMA_METADATA_URL, FMA_MEDIUM_URL]:
             local_path = output_dir / Path(url).name
+            hasher = hashlib.sha1() if url == FMA_MEDIUM_URL else None
             if not local_path.exists():
                 print(f"Downloading {url} to {local_path}...")
-                with requests.get(url, stream=True) as r:
+                with SESSION.get(url, stream=True) as r:
                     r.raise_for_status()
                     with open(local_path, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=8192):
+                        for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                             f.write(chunk)
+                            if hasher is not None:
+                                hasher.update(chunk)
+                if hasher is not None:
+                    medium_digest = hasher.hexdigest()
                 print(f"Finished downloading {local_path.name}")
             else:
                 print(f"File already exists, skipping download: {local_path}")
@@ -78,18 +150,29 @@ if __name__ == "__main__":
         # Verify checksum for fma_medium.zip
         medium_zip_path = output_dir / "fma_medium.zip"
         print(f"Verifying SHA1 checksum for {medium_zip_path.name}...")
-        sha1 = hashlib.sha1()
-        with open(medium_zip_path, 'rb') as f:
-            while chunk := f.read(8192):
-                sha1.update(chunk)
-        
-        if sha1.hexdigest() == FMA_MEDIUM_SHA1:
+        if medium_digest is not None:
+            digest = medium_digest
+        else:
+            # Pre-existing file: the bytes never went through the download
+            # loop, so hash it from disk.
+            with open(medium_zip_path, 'rb') as f:
+                if hasattr(hashlib, "file_digest"):
+                    # Python 3.11+: hashes in C over a large buffer without
+                    # holding the GIL, running at full OpenSSL speed.
+                    digest = hashlib.file_digest(f, "sha1").hexdigest()
+                else:
+                    sha1 = hashlib.sha1()
+                    while chunk := f.read(4 << 20):
+                        sha1.update(chunk)
+                    digest = sha1.hexdigest()
+
+        if digest == FMA_MEDIUM_SHA1:
             print("Checksum verification successful.")
         else:
             print(f"Error: Checksum mismatch for {medium_zip_path.name}.")
             exit(1)
 
-        # Extract archives using 7z
+        # Extract archives with several zipfile threads
         for zip_name in ["fma_metadata.zip", "fma_medium.zip"]:
             zip_path = output_dir / zip_name
             print(f"Extracting {zip_path}...")
@@ -97,30 +180,13 @@ if __name__ == "__main__":
             if zip_name == "fma_medium.zip" and (output_dir / "fma_medium").exists():
                  print(f"Extraction directory for {zip_name} already exists. Skipping.")
             else:
-                run_external_command(["7z", "x", zip_path, f"-o{output_dir}"])
+                extract_zip_parallel(zip_path, output_dir)
                 print(f"Removing {zip_path}")
                 zip_path.unlink()
 
         download_done_file.touch()
 
-    # 2. Generate SCP file for all raw FMA audio files
-    raw_scp_file = tmp_dir / "fma_noise.scp"
-    if raw_scp_file.exists():
-        print(f"Raw FMA scp file already exists. Skipping generation: {raw_scp_file}")
-    else:
-        print("[FMA] Generating scp file for all raw audio")
-        audio_base_dir = output_dir / "fma_medium"
-        audio_files = sorted(list(audio_base_dir.rglob("*.mp3")))
-        print(f"Found {len(audio_files)} raw FMA .mp3 files.")
-        
-        with open(raw_scp_file, "w") as f_scp:
-            for audio_path in audio_files:
-                # FMA filenames are numeric track IDs, e.g., '000002.mp3'
-                file_id = f"fma_{audio_path.stem}"
-                f_scp.write(f"{file_id} {audio_path.resolve()}\n")
-        print(f"Created raw FMA scp file: {raw_scp_file}")
-
-    # 3. Filter using the curation list
+    # 2. Generate the curated SCP file in a single pass over the audio tree
     filtered_scp_file = tmp_dir / "fma_noise_filtered_curation.scp"
     if filtered_scp_file.exists():
         print(f"Filtered scp file already exists. Delete {filtered_scp_file} to re-filter.")
@@ -129,19 +195,34 @@ if __name__ == "__main__":
             print(f"Error: Curation file not found at {curation_file}")
             print("Please create this file with the FMA track IDs you want to keep.")
             exit(1)
-            
-        print("[FMA] Filtering using curation list")
-        run_external_command(
-            [
-                "python", "utils/filter_via_curation_list.py",
-                "--scp_path", str(raw_scp_file),
-                "--curation_path", str(curation_file),
-                "--outfile", str(filtered_scp_file),
-            ],
-            env_vars={"OMP_NUM_THREADS": "1"}
-        )
 
-    # 4. Resample the filtered files to a single sampling rate
+        print("[FMA] Generating curated scp file")
+        # Curation membership is checked while the tree is walked, so the
+        # curated scp comes out of a single pass with no intermediate full
+        # scp to write, re-read and filter.
+        num_entries, curated_uids, curated_filenames = load_curation_sets(curation_file)
+        audio_base_dir = output_dir / "fma_medium"
+        audio_files = sorted(iter_audio_files(audio_base_dir, ".mp3"))
+        print(f"Found {len(audio_files)} raw FMA .mp3 files.")
+
+        # abspath is a pure string operation; resolve() stats every path
+        # component to chase symlinks, which adds up over the whole tree.
+        # FMA filenames are numeric track IDs, e.g., '000002.mp3'
+        scp_lines = []
+        for audio_path in audio_files:
+            file_id = f"fma_{audio_path.stem}"
+            if curated_uids:
+                keep = file_id in curated_uids
+            else:
+                keep = audio_path.name in curated_filenames
+            if keep:
+                scp_lines.append(f"{file_id} {os.path.abspath(audio_path)}\n")
+        with open(filtered_scp_file, "w") as f_scp:
+            f_scp.write("".join(scp_lines))
+        print(f"Kept {len(scp_lines)} of {len(audio_files)} files "
+              f"based on {num_entries} curation entries: {filtered_scp_file}")
+
+    # 3. Resample the filtered files to a single sampling rate
     resampled_scp_file = tmp_dir / f"fma_noise_resampled_filtered_curation.scp"
     if resampled_scp_file.exists():
         print(f"Resampled scp file already exists. Delete {resampled_scp_file} to re-resample.")
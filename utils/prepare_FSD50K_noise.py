@@ -1,11 +1,18 @@
 # Copyright 2025 Cisco Systems, Inc. and its affiliates
 # Apache-2.0
 
+import bisect
+import io
 import os
+import shutil
 import subprocess
 import requests
+import tarfile
+import zipfile
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from filter_via_curation_list import load_curation_sets
 
 # --- Configuration ---
 # Directories
@@ -16,6 +23,9 @@ resampled_dir = output_dir / "resampled" / "FSD50K.dev_audio"
 # Zenodo base URL for FSD50K files
 BASE_URL = "https://zenodo.org/records/4060432/files"
 
+# 1 MiB download chunks: tiny chunks make iter_content Python-overhead-bound
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
 # Files to download
 # Note: Audio files are handled separately due to being split
 METADATA_FILES = {
@@ -26,8 +36,145 @@ METADATA_FILES = {
 
 curation_file = Path("./datafiles/fsd50k/train_meta_curated.csv")
 
+# Shared session: connections to Zenodo are pooled across the download
+# threads, and transient server errors are retried with backoff instead of
+# killing an hours-long download run on the first 503.
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    requests.adapters.HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=requests.adapters.Retry(
+            total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+        ),
+    ),
+)
+
 # --- Helper Functions ---
 
+class MultiPartReader(io.RawIOBase):
+    """
+    Read-only, seekable view over the parts of a split zip archive.
+
+    A zip split set is the byte-wise concatenation of the .z01..z0N parts
+    followed by the main .zip, so presenting the parts as one contiguous
+    stream lets zipfile read the set in place. This replaces the
+    `zip -s 0` reassembly step, which rewrote the full multi-GB archive to
+    disk before extraction could even start.
+    """
+
+    def __init__(self, parts: list):
+        self._files = [open(p, "rb") for p in parts]
+        self._sizes = [os.fstat(f.fileno()).st_size for f in self._files]
+        self._offsets = []
+        total = 0
+        for size in self._sizes:
+            self._offsets.append(total)
+            total += size
+        self._total = total
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._total + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self._pos = max(0, min(pos, self._total))
+        return self._pos
+
+    def readinto(self, b):
+        if self._pos >= self._total:
+            return 0
+        idx = bisect.bisect_right(self._offsets, self._pos) - 1
+        local_pos = self._pos - self._offsets[idx]
+        part = self._files[idx]
+        part.seek(local_pos)
+        want = min(len(b), self._sizes[idx] - local_pos)
+        n = part.readinto(memoryview(b)[:want])
+        self._pos += n
+        return n
+
+    def close(self):
+        for f in self._files:
+            f.close()
+        super().close()
+
+
+def open_split_zip(parts: list) -> zipfile.ZipFile:
+    """Opens a split zip set (parts in order, main .zip last) for reading."""
+    reader = io.BufferedReader(MultiPartReader(parts), buffer_size=1 << 20)
+    return zipfile.ZipFile(reader)
+
+
+def _extract_zip_slice(parts: list, names: list, dest_dir: Path):
+    """Worker: extracts one slice of the archive's members into dest_dir."""
+    with open_split_zip(parts) as zf:
+        for name in names:
+            if name.endswith("/"):
+                continue
+            with zf.open(name) as src, open(dest_dir / name, "wb") as dst:
+                shutil.copyfileobj(src, dst, length=1 << 20)
+
+
+def extract_split_zip_parallel(parts: list, dest_dir: Path, max_workers: int = None):
+    """
+    Extracts a split zip set across several processes.
+
+    Deflate decompression is CPU-bound, so a single extractall leaves all
+    but one core idle. The member list is sliced across worker processes,
+    each of which opens its own reader over the parts; the directory tree
+    is created up front so the workers never race on mkdir.
+    """
+    with open_split_zip(parts) as zf:
+        names = zf.namelist()
+
+    for d in {os.path.dirname(name) for name in names}:
+        if d:
+            (dest_dir / d).mkdir(parents=True, exist_ok=True)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    slices = [names[i::max_workers] for i in range(max_workers)]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_extract_zip_slice, parts, s, dest_dir)
+            for s in slices if s
+        ]
+        for future in futures:
+            future.result()
+
+
+def iter_audio_files(root: Path, suffix: str):
+    """
+    Yields every file under root whose name ends with suffix.
+
+    Walks the tree with os.scandir on an explicit stack: each entry's type
+    comes back from the directory read itself, so no per-file stat calls are
+    made, unlike Path.rglob which stats every entry it matches.
+    """
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    yield Path(entry.path)
+
 def run_external_command(command: list, working_dir: Path = None, env_vars: dict = None):
     """Helper function to run external commands."""
     print(f"Running command: {' '.join(map(str, command))}")
@@ -35,20 +182,18 @@ def run_external_command(command: list, working_dir: Path = None, env_vars: dict
     if env_vars:
         process_env.update(env_vars)
     try:
+        # Let the child inherit stdout/stderr: capturing would buffer its
+        # whole output in memory and hide its progress bars until exit.
         result = subprocess.run(
             command,
             check=True,
             cwd=working_dir,
-            env=process_env,
-            capture_output=True,
-            text=True
+            env=process_env
         )
         return result
     except subprocess.CalledProcessError as e:
         print(f"Error running command in '{working_dir or '.'}': {' '.join(map(str, command))}")
         print(f"Return Code: {e.returncode}")
-        print(f"Stdout: {e.stdout}")
-        print(f"Stderr: {e.stderr}")
         exit(1)
 
 def download_file(url: str, local_path: Path):
@@ -58,10 +203,10 @@ def download_file(url: str, local_path: Path):
         return
     print(f"Downloading {url} to {local_path}...")
     try:
-        with requests.get(url, stream=True) as r:
+        with SESSION.get(url, stream=True) as r:
             r.raise_for_status()
             with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                     f.write(chunk)
         print(f"Finished downloading {local_path.name}")
     except requests.exceptions.RequestException as e:
@@ -101,20 +246,28 @@ if __name__ == "__main__":
             for future in futures:
                 future.result() # Wait for all downloads to complete
 
-        # Reassemble and extract the main audio archive
-        print("Reassembling and extracting FSD50K audio archive...")
-        unsplit_zip = "unsplit.zip"
-        run_external_command(
-            ["zip", "-s", "0", "FSD50K.dev_audio.zip", "--out", unsplit_zip],
-            working_dir=output_dir
-        )
-        run_external_command(["unzip", "-o", unsplit_zip], working_dir=output_dir)
+        # Extract the main audio archive directly from its split parts
+        print("Extracting FSD50K audio archive from its split parts...")
+        audio_zip_parts = [output_dir / f"FSD50K.dev_audio.z0{i}" for i in range(1, 6)]
+        audio_zip_parts.append(output_dir / "FSD50K.dev_audio.zip")
+        extract_split_zip_parallel(audio_zip_parts, output_dir)
 
-        # Clone Audioset ontology
+        # Fetch the Audioset ontology as a snapshot tarball: only the
+        # checked-out files are needed, so there is no reason to clone the
+        # full git history over the slow smart-HTTP protocol.
         ontology_dir = output_dir / "ontology"
         if not ontology_dir.exists():
-            print("Cloning Audioset ontology...")
-            run_external_command(["git", "clone", "https://github.com/audioset/ontology.git", str(ontology_dir)])
+            print("Downloading Audioset ontology snapshot...")
+            ontology_tarball = output_dir / "ontology.tar.gz"
+            download_file(
+                "https://github.com/audioset/ontology/archive/refs/heads/master.tar.gz",
+                ontology_tarball,
+            )
+            with tarfile.open(ontology_tarball, "r:gz") as tar:
+                tar.extractall(path=output_dir)
+            # The tarball unpacks as ontology-<branch>/
+            (output_dir / "ontology-master").rename(ontology_dir)
+            ontology_tarball.unlink()
         else:
             print("Ontology directory already exists.")
 
@@ -122,27 +275,10 @@ if __name__ == "__main__":
         print("Cleaning up downloaded archives...")
         for f in output_dir.glob("FSD50K.*.zip"): f.unlink()
         for f in output_dir.glob("FSD50K.*.z*"): f.unlink()
-        if (output_dir / unsplit_zip).exists(): (output_dir / unsplit_zip).unlink()
 
         download_done_file.touch()
 
-    # 2. Generate SCP file for all raw FSD50K audio files
-    raw_scp_file = tmp_dir / "fsd50k_noise.scp"
-    if raw_scp_file.exists():
-        print(f"Raw FSD50K scp file already exists. Skipping generation: {raw_scp_file}")
-    else:
-        print("[FSD50K] Generating scp file for all raw audio")
-        audio_base_dir = output_dir / "FSD50K.dev_audio"
-        audio_files = sorted(list(audio_base_dir.rglob("*.wav")))
-        print(f"Found {len(audio_files)} raw FSD50K .wav files.")
-        
-        with open(raw_scp_file, "w") as f_scp:
-            for audio_path in audio_files:
-                file_id = f"fsd50k_{audio_path.stem}"
-                f_scp.write(f"{file_id} {audio_path.resolve()}\n")
-        print(f"Created raw FSD50K scp file: {raw_scp_file}")
-
-    # 3. Filter using the curation list
+    # 2. Generate the curated SCP file in a single pass over the audio tree
     filtered_scp_file = tmp_dir / "fsd50k_noise_filtered_curation.scp"
     if filtered_scp_file.exists():
         print(f"Filtered scp file already exists. Delete {filtered_scp_file} to re-filter.")
@@ -151,19 +287,33 @@ if __name__ == "__main__":
             print(f"Error: Curation file not found at {curation_file}")
             print("Please create this file with the FSD50K file IDs you want to keep.")
             exit(1)
-            
-        print("[FSD50K] Filtering using curation list")
-        run_external_command(
-            [
-                "python", "utils/filter_via_curation_list.py",
-                "--scp_path", str(raw_scp_file),
-                "--curation_path", str(curation_file),
-                "--outfile", str(filtered_scp_file),
-            ],
-            env_vars={"OMP_NUM_THREADS": "1"}
-        )
 
-    # 4. Resample the filtered files to a single sampling rate
+        print("[FSD50K] Generating curated scp file")
+        # Curation membership is checked while the tree is walked, so the
+        # curated scp comes out of a single pass with no intermediate full
+        # scp to write, re-read and filter.
+        num_entries, curated_uids, curated_filenames = load_curation_sets(curation_file)
+        audio_base_dir = output_dir / "FSD50K.dev_audio"
+        audio_files = sorted(iter_audio_files(audio_base_dir, ".wav"))
+        print(f"Found {len(audio_files)} raw FSD50K .wav files.")
+
+        # abspath is a pure string operation; resolve() stats every path
+        # component to chase symlinks, which adds up over the whole tree.
+        scp_lines = []
+        for audio_path in audio_files:
+            file_id = f"fsd50k_{audio_path.stem}"
+            if curated_uids:
+                keep = file_id in curated_uids
+            else:
+                keep = audio_path.name in curated_filenames
+            if keep:
+                scp_lines.append(f"{file_id} {os.path.abspath(audio_path)}\n")
+        with open(filtered_scp_file, "w") as f_scp:
+            f_scp.write("".join(scp_lines))
+        print(f"Kept {len(scp_lines)} of {len(audio_files)} files "
+              f"based on {num_entries} curation entries: {filtered_scp_file}")
+
+    # 3. Resample the filtered files to a single sampling rate
     resampled_scp_file = tmp_dir / f"fsd50k_noise_resampled_filtered_curation.scp"
     if resampled_scp_file.exists():
         print(f"Resampled scp file already exists. Delete {resampled_scp_file} to re-resample.")
@@ -2,9 +2,14 @@
 # Apache-2.0
 
 import os
+import shutil
 import subprocess
 import requests
+import zipfile
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from filter_via_curation_list import load_curation_sets, filter_scp_stream
 
 # --- Configuration ---
 # Directories
@@ -17,8 +22,66 @@ WHAM_URL = "https://my-bucket-a8b4b49c25c811ee9a7e8bba05fa24c7.s3.amazonaws.com/
 
 curation_file = Path("./datafiles/wham/train_meta_curated.csv")
 
+# Shared session: transient server errors are retried with backoff instead
+# of killing an hours-long download run on the first 503.
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    requests.adapters.HTTPAdapter(
+        max_retries=requests.adapters.Retry(
+            total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+        )
+    ),
+)
+
 # --- Helper Functions ---
 
+def iter_audio_files(root: Path, suffix: str):
+    """
+    Yields every file under root whose name ends with suffix.
+
+    Walks the tree with os.scandir on an explicit stack: each entry's type
+    comes back from the directory read itself, so no per-file stat calls are
+    made, unlike Path.rglob which stats every entry it matches.
+    """
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    yield Path(entry.path)
+
+def extract_zip_parallel(zip_path: Path, dest_dir: Path, max_workers: int = 8):
+    """
+    Extracts a zip archive with several threads.
+
+    Each worker opens its own ZipFile handle (a shared handle serializes all
+    reads on an internal lock), and the directory tree is created up front
+    so the copy loops never race on mkdir. zlib decompression releases the
+    GIL, so the workers genuinely overlap.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        names = zf.namelist()
+
+    for d in {os.path.dirname(name) for name in names}:
+        if d:
+            (dest_dir / d).mkdir(parents=True, exist_ok=True)
+
+    def worker(batch):
+        with zipfile.ZipFile(zip_path) as zf:
+            for name in batch:
+                if name.endswith("/"):
+                    continue
+                with zf.open(name) as src, open(dest_dir / name, "wb") as dst:
+                    shutil.copyfileobj(src, dst, length=1 << 20)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batches = [names[i::max_workers] for i in range(max_workers)]
+        for future in [executor.submit(worker, b) for b in batches]:
+            future.result()
+
 def run_external_command(command: list, working_dir: Path = None, env_vars: dict = None):
     """Helper function to run external commands."""
     print(f"Running command: {' '.join(map(str, command))}")
@@ -26,22 +89,61 @@ def run_external_command(command: list, working_dir: Path = None, env_vars: dict
     if env_vars:
         process_env.update(env_vars)
     try:
+        # Let the child inherit stdout/stderr: capturing would buffer its
+        # whole output in memory and hide its progress bars until exit.
         result = subprocess.run(
             command,
             check=True,
             cwd=working_dir,
-            env=process_env,
-            capture_output=True,
-            text=True
+            env=process_env
         )
         return result
     except subprocess.CalledProcessError as e:
         print(f"Error running command in '{working_dir or '.'}': {' '.join(map(str, command))}")
         print(f"Return Code: {e.returncode}")
-        print(f"Stdout: {e.stdout}")
-        print(f"Stderr: {e.stderr}")
         exit(1)
 
+# 1 MiB download chunks: tiny chunks make iter_content Python-overhead-bound
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+# The zip is fetched over this many concurrent HTTP range requests when the
+# server advertises Accept-Ranges; below RANGE_MIN_SIZE a single stream is
+# cheaper than the extra connection setup.
+RANGE_CONNECTIONS = 8
+RANGE_MIN_SIZE = 64 << 20
+
+def _download_range(url: str, fd: int, start: int, stop: int):
+    """Fetches bytes [start, stop) of url and pwrites them into fd."""
+    headers = {"Range": f"bytes={start}-{stop - 1}"}
+    with SESSION.get(url, headers=headers, stream=True) as r:
+        r.raise_for_status()
+        offset = start
+        for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+
+def download_ranged(url: str, local_path: Path, total_size: int):
+    """
+    Downloads url into local_path over several concurrent range requests.
+
+    The file is preallocated and each connection pwrites its slice directly
+    at the right offset, so no reassembly pass is needed afterwards.
+    """
+    bounds = [
+        total_size * i // RANGE_CONNECTIONS for i in range(RANGE_CONNECTIONS + 1)
+    ]
+    fd = os.open(local_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC)
+    try:
+        os.truncate(fd, total_size)
+        with ThreadPoolExecutor(max_workers=RANGE_CONNECTIONS) as executor:
+            futures = [
+                executor.submit(_download_range, url, fd, bounds[i], bounds[i + 1])
+                for i in range(RANGE_CONNECTIONS)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+
 def download_file(url: str, local_path: Path):
     """Downloads a single file."""
     if local_path.exists():
@@ -49,11 +151,21 @@ def download_file(url: str, local_path: Path):
         return
     print(f"Downloading {url} to {local_path}...")
     try:
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        # Probe whether the server supports range requests; if it does and
+        # the file is large, split it across several connections.
+        head = SESSION.head(url, allow_redirects=True)
+        head.raise_for_status()
+        total_size = int(head.headers.get("Content-Length", 0))
+        accepts_ranges = head.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+        if accepts_ranges and total_size >= RANGE_MIN_SIZE:
+            download_ranged(url, local_path, total_size)
+        else:
+            with SESSION.get(url, stream=True) as r:
+                r.raise_for_status()
+                with open(local_path, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
         print(f"Finished downloading {local_path.name}")
     except requests.exceptions.RequestException as e:
         print(f"Error downloading {url}: {e}")
@@ -80,7 +192,7 @@ if __name__ == "__main__":
         download_file(WHAM_URL, wham_zip_path)
         
         print(f"Extracting {wham_zip_path}...")
-        run_external_command(["unzip", "-o", wham_zip_path.name], working_dir=output_dir)
+        extract_zip_parallel(wham_zip_path, output_dir)
 
         download_done_file.touch()
 
@@ -95,13 +207,20 @@ if __name__ == "__main__":
             print(f"Error: Audio directory not found at {audio_base_dir}")
             exit(1)
             
-        audio_files = sorted(list(audio_base_dir.rglob("*.wav")))
+        audio_files = sorted(iter_audio_files(audio_base_dir, ".wav"))
         print(f"Found {len(audio_files)} raw WHAM! .wav files.")
         
+        # Every path from the walk starts with audio_base_dir, so resolve
+        # the base once and splice the relative tail onto it, instead of an
+        # abspath normalization pass per file.
+        base_len = len(str(audio_base_dir))
+        base_abs = str(audio_base_dir.resolve())
+        scp_lines = [
+            f"{audio_path.stem} {base_abs}{str(audio_path)[base_len:]}\n"
+            for audio_path in audio_files
+        ]
         with open(raw_scp_file, "w") as f_scp:
-            for audio_path in audio_files:
-                file_id = f"{audio_path.stem}"
-                f_scp.write(f"{file_id} {audio_path.resolve()}\n")
+            f_scp.write("".join(scp_lines))
         print(f"Created raw WHAM! scp file: {raw_scp_file}")
 
     # 3. Filter using the curation list
@@ -115,15 +234,13 @@ if __name__ == "__main__":
             exit(1)
             
         print("[WHAM!] Filtering using curation list")
-        run_external_command(
-            [
-                "python", "utils/filter_via_curation_list.py",
-                "--scp_path", str(raw_scp_file),
-                "--curation_path", str(curation_file),
-                "--outfile", str(filtered_scp_file),
-            ],
-            env_vars={"OMP_NUM_THREADS": "1"}
+        # Filter in-process: spawning a fresh interpreter just re-imports the
+        # stack and re-parses arguments before doing the same streaming pass.
+        num_entries, curated_uids, curated_filenames = load_curation_sets(curation_file)
+        total, kept = filter_scp_stream(
+            raw_scp_file, filtered_scp_file, curated_uids, curated_filenames
         )
+        print(f"Filtered based on {num_entries} curation entries: {total} samples -> {kept} samples")
 
     # 4. Resample the filtered files to a single sampling rate
     resampled_scp_file = tmp_dir / f"wham_noise_resampled_filtered_curation.scp"
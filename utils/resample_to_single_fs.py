@@ -1,47 +1,90 @@
 # Copyright 2025 Cisco Systems, Inc. and its affiliates
 # Apache-2.0
 
-import math
-from functools import partial
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import soundfile as sf
-import numpy as np
+import soxr
 
 # import librosa
-from scipy.signal import resample_poly
-from tqdm.contrib.concurrent import process_map
+from tqdm import tqdm
 
+# Job parameters, seeded once per worker by _init_worker. Sending them
+# through the pool initializer replaces functools.partial, which re-pickles
+# every bound argument onto each task.
+_OUT_FS = None
+_OUTDIR = None
+_EXISTING = frozenset()
 
-def resample_to_single_fs(
-    uid_path_bw, idx, out_fs, max_files_per_dir, num_digits, outdir
-):
+
+def _init_worker(out_fs, outdir, existing):
+    global _OUT_FS, _OUTDIR, _EXISTING
+    _OUT_FS = out_fs
+    _OUTDIR = outdir
+    _EXISTING = existing
+
+
+def resample_to_single_fs(uid_path_bw, subdir):
     uid, audio_path = uid_path_bw
 
-    subdir = f"{idx // max_files_per_dir:0{num_digits}x}"
-    outfile = Path(outdir).resolve() / subdir / (uid + ".wav")
-    # outfile = Path(outdir).resolve() / subdir / (uid + ".flac")
+    # Plain strings throughout: the return value crosses the process
+    # boundary, and pickling a str is cheaper than pickling a Path.
+    outfile = os.path.join(_OUTDIR, subdir, uid + ".wav")
+    # outfile = os.path.join(_OUTDIR, subdir, uid + ".flac")
 
-    if outfile.exists():
-        return uid, outfile, out_fs
+    # _EXISTING is the set of output files found in a single walk at
+    # startup; checking membership replaces a stat syscall per task, which
+    # dominates fully-resumed runs.
+    if outfile in _EXISTING:
+        return uid, outfile, _OUT_FS
 
     try:
-        audio, fs = sf.read(audio_path)
-    except:
-        print(f"Error: cannot open audio file '{audio_path}'. Skipping it", flush=True)
+        # A zero-size file is the common corruption mode after an interrupted
+        # download/extraction; one stat is much cheaper than having
+        # libsndfile probe it against every codec before failing.
+        if os.stat(audio_path).st_size == 0:
+            print(f"Error: audio file '{audio_path}' is empty. Skipping it", flush=True)
+            return
+        fs = sf.info(audio_path).samplerate
+    except (sf.LibsndfileError, OSError) as e:
+        # Catching only decode/IO errors (not bare except) keeps real bugs
+        # and KeyboardInterrupt from being swallowed inside the pool.
+        print(f"Error: cannot open audio file '{audio_path}' ({e}). Skipping it", flush=True)
         return
 
-    if out_fs == fs:
-        return uid, audio_path, fs
+    os.makedirs(os.path.dirname(outfile), exist_ok=True)
 
-    outfile.parent.mkdir(parents=True, exist_ok=True)
+    if _OUT_FS == fs:
+        # Already at the target rate: hard-link the file into the output
+        # layout (a metadata-only operation, falling back to a byte copy
+        # across filesystems) instead of returning the source path, so the
+        # output scp never points back into the source tree and nothing is
+        # decoded or re-encoded.
+        try:
+            os.link(audio_path, outfile)
+        except OSError:
+            shutil.copyfile(audio_path, outfile)
+        return uid, outfile, fs
 
-    divisor = np.gcd(int(fs), int(out_fs))
-    p, q = int(out_fs / divisor), int(fs / divisor)
-    
-    audio = resample_poly(audio, p, q)
-    sf.write(str(outfile), audio, out_fs)
-    return uid, outfile, out_fs
+    try:
+        # float32 halves the memory traffic of the default float64 and is
+        # soxr's native sample type, so no conversion pass is needed.
+        audio, fs = sf.read(audio_path, dtype="float32", always_2d=False)
+    except (sf.LibsndfileError, OSError) as e:
+        print(f"Error: cannot open audio file '{audio_path}' ({e}). Skipping it", flush=True)
+        return
+
+    # soxr takes the rates directly (no gcd/p/q derivation) and its C
+    # resampler is considerably faster than scipy's polyphase filter at
+    # the same quality setting.
+    audio = soxr.resample(audio, fs, _OUT_FS, quality="HQ")
+    # PCM_16 is what soundfile picks for float input to .wav anyway; saying
+    # so keeps the output format pinned rather than type-dependent.
+    sf.write(outfile, audio, _OUT_FS, subtype="PCM_16")
+    return uid, outfile, _OUT_FS
 
 
 if __name__ == "__main__":
@@ -90,26 +133,47 @@ if __name__ == "__main__":
             uid, path = line.strip().split(maxsplit=1)
             audios.append((uid, path))
 
-    indices = list(range(len(audios)))
-    num_digits = math.ceil(math.log(len(indices) / args.max_files, 16))
+    # Pure integer arithmetic: the old math.log formula went through float
+    # math and raised a ValueError whenever the input fit in a single
+    # sub-directory (log of a value <= 1).
+    n_dirs = max(1, (len(audios) + args.max_files - 1) // args.max_files)
+    num_digits = max(1, ((n_dirs - 1).bit_length() + 3) // 4)
+    # Format each sub-directory name once here rather than once per task in
+    # the workers; a subdir string pickles no heavier than the index did.
+    subdirs = [
+        f"{i // args.max_files:0{num_digits}x}" for i in range(len(audios))
+    ]
 
     Path(args.outdir).mkdir(parents=True, exist_ok=True)
 
-    ret = process_map(
-        partial(
-            resample_to_single_fs,
-            max_files_per_dir=args.max_files,
-            num_digits=num_digits,
-            out_fs=args.out_fs,
-            outdir=args.outdir,
-        ),
-        audios,
-        indices,
-        max_workers=args.nj,
-        chunksize=args.chunksize,
+    # Collect the outputs that already exist in one walk (os.walk reads the
+    # file names straight out of the directory entries, no per-file stat),
+    # so resumed runs skip finished files without touching the disk again.
+    outdir_resolved = str(Path(args.outdir).resolve())
+    existing = frozenset(
+        os.path.join(dirpath, name)
+        for dirpath, _, filenames in os.walk(outdir_resolved)
+        for name in filenames
+        if name.endswith(".wav")
     )
 
+    with ProcessPoolExecutor(
+        max_workers=args.nj,
+        initializer=_init_worker,
+        initargs=(args.out_fs, outdir_resolved, existing),
+    ) as executor:
+        ret = list(
+            tqdm(
+                executor.map(
+                    resample_to_single_fs, audios, subdirs, chunksize=args.chunksize
+                ),
+                total=len(audios),
+            )
+        )
+
     Path(args.out_scpfile).parent.mkdir(parents=True, exist_ok=True)
-    with open(args.out_scpfile, "w") as f:
-        for uid, audio_path, fs in ret:
-            f.write(f"{uid} {fs} {audio_path}\n")
+    # Unreadable inputs come back as None from the worker; drop them so they
+    # simply fall out of the output scp instead of crashing the unpack below.
+    ret = [r for r in ret if r is not None]
+    with open(args.out_scpfile, "w", buffering=1 << 20) as f:
+        f.writelines(f"{uid} {fs} {audio_path}\n" for uid, audio_path, fs in ret)